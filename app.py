@@ -1,11 +1,18 @@
+import asyncio
+import functools
 import logging
-import json
 import os
-from fastapi import FastAPI, Request, HTTPException
+import sqlite3
+import threading
+import time
+import orjson
+from fastapi import FastAPI, Request, HTTPException, BackgroundTasks
 import httpx
-from typing import Dict, Any, Optional
+import msgspec
+from typing import Dict, Any, Iterable, List, Optional, Tuple
 from pydantic import BaseModel
 from datetime import datetime
+from pathlib import Path
 
 
 logging.basicConfig(
@@ -21,66 +28,394 @@ TELEGRAM_CHAT_IDS = {
     "default": "",
 }
 
+TELEGRAM_CLIENT = httpx.AsyncClient(
+    base_url="https://api.telegram.org",
+    http2=True,
+    timeout=5.0,
+    limits=httpx.Limits(max_keepalive_connections=20),
+)
+
+# ID статусов успешно реализованных сделок
+SUCCESSFUL_STATUS_IDS = frozenset({"142", "143"})
+
 DATA_DIR = "data"
 os.makedirs(DATA_DIR, exist_ok=True)
 
+DB_PATH = os.path.join(DATA_DIR, "statuses.db")
+
+# Задержка перед записью изменённых статусов в базу (сек)
+STATUS_FLUSH_DELAY = 0.5
+# Сколько ждать освобождения базы, занятой другим воркером (сек)
+DB_BUSY_TIMEOUT = 30.0
+
+# Статусы, ещё не записанные в базу: scope_id -> {ID статуса: (название, время)}
+_PENDING: Dict[str, Dict[str, Tuple[str, str]]] = {}
+# Не больше одной задачи записи на аккаунт: следующая запись начинается
+# только после завершения предыдущей
+_FLUSH_TASKS: Dict[str, asyncio.Task] = {}
+# Приложение останавливается: повторные попытки записи не планируются
+_STOPPING = False
+
+_DB = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT, check_same_thread=False)
+_DB.execute("PRAGMA journal_mode=WAL")
+_DB.execute("PRAGMA synchronous=NORMAL")
+_DB.execute(
+    """CREATE TABLE IF NOT EXISTS statuses (
+        scope_id TEXT,
+        status_id TEXT,
+        name TEXT,
+        first_seen TEXT,
+        last_updated TEXT,
+        PRIMARY KEY (scope_id, status_id)
+    )"""
+)
+# Соединение для записи используется из потоков asyncio.to_thread
+_DB_LOCK = threading.Lock()
+
+# Чтение идёт через asyncio.to_thread, у каждого потока своё соединение.
+# В режиме WAL читатели не ждут писателей, поэтому общая блокировка не нужна.
+_DB_READERS: List[sqlite3.Connection] = []
+_DB_READERS_LOCK = threading.Lock()
+_DB_READER_LOCAL = threading.local()
+
+
+def _db_reader() -> sqlite3.Connection:
+    """Возвращает соединение для чтения, открытое для текущего потока"""
+    reader = getattr(_DB_READER_LOCAL, "connection", None)
+    if reader is None:
+        reader = sqlite3.connect(
+            f"file:{DB_PATH}?mode=ro",
+            uri=True,
+            timeout=DB_BUSY_TIMEOUT,
+            check_same_thread=False,
+        )
+        _DB_READER_LOCAL.connection = reader
+        with _DB_READERS_LOCK:
+            _DB_READERS.append(reader)
+    return reader
+
+
+_UPSERT_STATUS_SQL = """
+    INSERT INTO statuses (scope_id, status_id, name, first_seen)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (scope_id, status_id) DO UPDATE SET
+        name = excluded.name,
+        last_updated = excluded.first_seen
+"""
+
+_IMPORT_STATUS_SQL = """
+    INSERT OR IGNORE INTO statuses
+        (scope_id, status_id, name, first_seen, last_updated)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+# Готовые строки заголовков сообщений: тип события -> заголовок
+_LEAD_HEADERS = {
+    "new": "📝 <b>Создана новая сделка</b>",
+    "update": "🔄 <b>Обновлена сделка</b>",
+    "success": "🎉 <b>Успешно реализованная сделка</b>",
+}
+_LEAD_DEFAULT_HEADER = "ℹ️ <b>Информация о сделке</b>"
+
+_TASK_HEADERS = {
+    "new": "⏰ <b>Создана новая задача</b>",
+    "completed": "✅ <b>Задача выполнена</b>",
+}
+_TASK_DEFAULT_HEADER = "📋 <b>Информация о задаче</b>"
+
+_CONTACT_HEADERS = {
+    "new": "👤 <b>Создан новый контакт</b>",
+}
+_CONTACT_DEFAULT_HEADER = "👤 <b>Обновлен контакт</b>"
+
+
+# Модели данных webhook. Отсутствующие в payload поля остаются UNSET,
+# чтобы отличать их от переданного null.
+class Lead(msgspec.Struct):
+    """Сделка из webhook"""
+
+    add: Any = msgspec.UNSET
+    update: Any = msgspec.UNSET
+    name: Any = "Без названия"
+    price: Any = msgspec.UNSET
+    responsible_user_name: Any = msgspec.UNSET
+    status_id: Any = None
+    status_name: Any = msgspec.UNSET
+
+
+class Task(msgspec.Struct):
+    """Задача из webhook"""
+
+    add: Any = msgspec.UNSET
+    update: Any = msgspec.UNSET
+    text: Any = "Без описания"
+    complete_till: Any = msgspec.UNSET
+    responsible_user_name: Any = msgspec.UNSET
+    is_completed: Any = None
+
+
+class Contact(msgspec.Struct):
+    """Контакт из webhook"""
+
+    add: Any = msgspec.UNSET
+    update: Any = msgspec.UNSET
+    name: Any = "Без имени"
+    custom_fields: Any = msgspec.UNSET
+
+
+class Status(msgspec.Struct):
+    """Статус сделки"""
+
+    id: Any = None
+    name: Any = None
+
+
+class Pipeline(msgspec.Struct):
+    """Воронка со статусами"""
+
+    statuses: List[Status] = []
+
+
+class AmoWebhook(msgspec.Struct):
+    """Данные webhook от amoCRM"""
+
+    leads: Optional[List[Lead]] = None
+    tasks: Optional[List[Task]] = None
+    contacts: Optional[List[Contact]] = None
+    lead_statuses: Optional[List[Status]] = None
+    pipelines: Optional[List[Pipeline]] = None
+
+
+_WEBHOOK_DECODER = msgspec.json.Decoder(AmoWebhook)
+
+
+@functools.lru_cache(maxsize=1)
+def _iso_time_for_second(second: int) -> str:
+    """Форматирует время с точностью до секунды"""
+    return datetime.fromtimestamp(second).isoformat()
+
+
+def current_iso_time() -> str:
+    """Возвращает текущее время в ISO формате, кэшируя значение на секунду"""
+    return _iso_time_for_second(int(time.time()))
+
+
+@functools.lru_cache(maxsize=1024)
+def format_timestamp(timestamp: int) -> str:
+    """Форматирует unix-время как ДД.ММ.ГГГГ ЧЧ:ММ"""
+    t = time.localtime(timestamp)
+    return (
+        f"{t.tm_mday:02d}.{t.tm_mon:02d}.{t.tm_year:04d} "
+        f"{t.tm_hour:02d}:{t.tm_min:02d}"
+    )
+
+
+def _status_info(name, first_seen, last_updated) -> Dict[str, Any]:
+    """Собирает описание статуса из строки базы данных"""
+    info = {"name": name, "first_seen": first_seen}
+    if last_updated is not None:
+        info["last_updated"] = last_updated
+    return info
+
 
 class DataManager:
     """Класс для управления данными из amoCRM"""
 
     @staticmethod
-    def get_status_file_path(scope_id):
-        """Возвращает путь к файлу для хранения статусов конкретного аккаунта"""
-        return os.path.join(DATA_DIR, f"lead_statuses_{scope_id}.json")
+    def _import_legacy_files():
+        """Переносит статусы из старых JSON файлов в базу данных"""
+        for file_path in Path(DATA_DIR).glob("lead_statuses_*.json"):
+            scope_id = file_path.stem[len("lead_statuses_") :]
+            with open(file_path, "rb") as file:
+                statuses = orjson.loads(file.read())
+            rows = [
+                (
+                    scope_id,
+                    str(status_id),
+                    info.get("name"),
+                    info.get("first_seen"),
+                    info.get("last_updated"),
+                )
+                for status_id, info in statuses.items()
+            ]
+            # Уже сохранённые в базе статусы не перезаписываются
+            with _DB_LOCK, _DB:
+                _DB.executemany(_IMPORT_STATUS_SQL, rows)
+            logger.info(
+                f"Статусы сделок для аккаунта {scope_id} перенесены в базу данных"
+            )
 
     @staticmethod
-    def load_lead_statuses(scope_id):
-        """Загружает статусы сделок из JSON файла"""
-        file_path = DataManager.get_status_file_path(scope_id)
+    async def import_legacy_statuses():
+        """Переносит статусы из JSON файлов, оставшихся от прежнего формата"""
         try:
-            if os.path.exists(file_path):
-                with open(file_path, "r", encoding="utf-8") as file:
-                    return json.load(file)
-            return {}
+            await asyncio.to_thread(DataManager._import_legacy_files)
+        except Exception as e:
+            logger.error(f"Ошибка переноса статусов сделок: {str(e)}")
+
+    @staticmethod
+    def _select_statuses(scope_id):
+        """Читает строки статусов аккаунта"""
+        return (
+            _db_reader()
+            .execute(
+                "SELECT status_id, name, first_seen, last_updated "
+                "FROM statuses WHERE scope_id = ?",
+                (scope_id,),
+            )
+            .fetchall()
+        )
+
+    @staticmethod
+    async def load_lead_statuses(scope_id):
+        """Загружает статусы сделок из базы данных"""
+        try:
+            rows = await asyncio.to_thread(DataManager._select_statuses, scope_id)
+            return {row[0]: _status_info(*row[1:]) for row in rows}
         except Exception as e:
             logger.error(f"Ошибка загрузки статусов сделок: {str(e)}")
             return {}
 
     @staticmethod
-    def save_lead_statuses(scope_id, statuses):
-        """Сохраняет статусы сделок в JSON файл"""
-        file_path = DataManager.get_status_file_path(scope_id)
+    def _write_rows(rows):
+        """Записывает строки статусов одной транзакцией"""
+        with _DB_LOCK, _DB:
+            _DB.executemany(_UPSERT_STATUS_SQL, rows)
+
+    @staticmethod
+    async def save_lead_statuses(scope_id, pending: Dict[str, Tuple[str, str]]):
+        """Сохраняет статусы сделок в базу данных, возвращает успех записи"""
         try:
-            with open(file_path, "w", encoding="utf-8") as file:
-                json.dump(statuses, file, ensure_ascii=False, indent=2)
+            rows = [
+                (scope_id, status_id, name, now_iso)
+                for status_id, (name, now_iso) in pending.items()
+            ]
+            await asyncio.to_thread(DataManager._write_rows, rows)
             logger.info(f"Статусы сделок для аккаунта {scope_id} сохранены")
+            return True
         except Exception as e:
             logger.error(f"Ошибка сохранения статусов сделок: {str(e)}")
+            return False
 
     @staticmethod
-    def update_lead_status(scope_id, status_id, status_name):
-        """Обновляет или добавляет статус сделки"""
-        statuses = DataManager.load_lead_statuses(scope_id)
-        status_id_str = str(status_id)  # Преобразуем в строку для совместимости с JSON
-
-        if status_id_str not in statuses:
-            statuses[status_id_str] = {
-                "name": status_name,
-                "first_seen": datetime.now().isoformat(),
-            }
-        else:
-            statuses[status_id_str]["name"] = status_name
-            statuses[status_id_str]["last_updated"] = datetime.now().isoformat()
-
-        DataManager.save_lead_statuses(scope_id, statuses)
+    async def get_lead_statuses(scope_id):
+        """Возвращает статусы сделок из базы с учётом ещё не записанных"""
+        statuses = await DataManager.load_lead_statuses(scope_id)
+        for status_id, (name, now_iso) in _PENDING.get(scope_id, {}).items():
+            info = statuses.get(status_id)
+            if info is None:
+                statuses[status_id] = {"name": name, "first_seen": now_iso}
+            else:
+                info["name"] = name
+                info["last_updated"] = now_iso
         return statuses
 
     @staticmethod
-    def get_status_name(scope_id, status_id):
+    def schedule_flush(scope_id):
+        """Планирует запись изменённых статусов аккаунта в базу"""
+        if scope_id in _FLUSH_TASKS:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Вне event loop откладывать запись некуда
+            asyncio.run(DataManager.flush(scope_id))
+            return
+        _FLUSH_TASKS[scope_id] = loop.create_task(
+            DataManager._delayed_flush(scope_id)
+        )
+
+    @staticmethod
+    async def _delayed_flush(scope_id):
+        """Записывает статусы в базу после задержки, объединяя изменения"""
+        try:
+            await asyncio.sleep(STATUS_FLUSH_DELAY)
+            await DataManager.flush(scope_id)
+        finally:
+            # Задача снимается с учёта только после окончания записи
+            _FLUSH_TASKS.pop(scope_id, None)
+        # Статусы, изменённые во время записи или не записанные из-за ошибки
+        if _PENDING.get(scope_id) and not _STOPPING:
+            DataManager.schedule_flush(scope_id)
+
+    @staticmethod
+    async def flush(scope_id):
+        """Записывает изменённые статусы аккаунта в базу"""
+        pending = _PENDING.pop(scope_id, None)
+        if not pending:
+            return
+        if await DataManager.save_lead_statuses(scope_id, pending):
+            return
+        # Возвращаем неудачно записанные статусы. Записи аккаунта идут строго
+        # по очереди, поэтому всё, что сейчас в _PENDING, новее возвращаемого.
+        current = _PENDING.setdefault(scope_id, {})
+        for status_id, value in pending.items():
+            current.setdefault(status_id, value)
+
+    @staticmethod
+    async def flush_all():
+        """Записывает в базу все изменённые статусы"""
+        global _STOPPING
+        _STOPPING = True
+        # Дожидаемся уже запланированных и выполняющихся записей
+        while _FLUSH_TASKS:
+            await asyncio.gather(*_FLUSH_TASKS.values(), return_exceptions=True)
+        for scope_id in list(_PENDING):
+            await DataManager.flush(scope_id)
+
+    @staticmethod
+    def update_lead_status(
+        scope_id, status_id, status_name, now_iso: Optional[str] = None
+    ):
+        """Обновляет или добавляет статус сделки"""
+        DataManager.bulk_update_lead_statuses(
+            scope_id, [(status_id, status_name)], now_iso
+        )
+
+    @staticmethod
+    def bulk_update_lead_statuses(
+        scope_id, items: Iterable[Tuple[Any, str]], now_iso: Optional[str] = None
+    ):
+        """Обновляет или добавляет несколько статусов сделок за одну запись"""
+        if now_iso is None:
+            now_iso = current_iso_time()
+
+        pending = _PENDING.setdefault(scope_id, {})
+        for status_id, status_name in items:
+            # Преобразуем в строку для совместимости с ключами в базе
+            pending[str(status_id)] = (status_name, now_iso)
+
+        DataManager.schedule_flush(scope_id)
+
+    @staticmethod
+    def _select_status_name(scope_id, status_id):
+        """Читает строку с названием статуса"""
+        return (
+            _db_reader()
+            .execute(
+                "SELECT name FROM statuses WHERE scope_id = ? AND status_id = ?",
+                (scope_id, status_id),
+            )
+            .fetchone()
+        )
+
+    @staticmethod
+    async def get_status_name(scope_id, status_id):
         """Возвращает название статуса по его ID"""
-        statuses = DataManager.load_lead_statuses(scope_id)
         status_id_str = str(status_id)
-        return statuses.get(status_id_str, {}).get("name", f"Статус {status_id}")
+        pending = _PENDING.get(scope_id, {}).get(status_id_str)
+        if pending is not None:
+            return pending[0]
+        try:
+            row = await asyncio.to_thread(
+                DataManager._select_status_name, scope_id, status_id_str
+            )
+        except Exception as e:
+            logger.error(f"Ошибка загрузки статуса сделки: {str(e)}")
+            row = None
+        if row is None:
+            return f"Статус {status_id}"
+        return row[0]
 
 
 class TelegramMessage:
@@ -91,239 +426,306 @@ class TelegramMessage:
         chat_id: str, text: str, parse_mode: str = "HTML"
     ) -> Dict[str, Any]:
         """Отправляет сообщение в Telegram чат"""
-        url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url, json={"chat_id": chat_id, "text": text, "parse_mode": parse_mode}
-            )
-            return response.json()
+        response = await TELEGRAM_CLIENT.post(
+            f"/bot{TELEGRAM_TOKEN}/sendMessage",
+            json={"chat_id": chat_id, "text": text, "parse_mode": parse_mode},
+        )
+        return response.json()
 
 
 class AmoCRMHandler:
     """Класс для обработки данных из amoCRM"""
 
     @staticmethod
-    def format_lead_message(
-        lead: Dict[str, Any], event_type: str, scope_id: str
+    async def format_lead_message(
+        lead: Lead, event_type: str, scope_id: str
     ) -> str:
         """Форматирует сообщение о сделке"""
-        if event_type == "new":
-            emoji = "📝"
-            title = "Создана новая сделка"
-        elif event_type == "update":
-            emoji = "🔄"
-            title = f"Обновлена сделка"
-        elif event_type == "success":
-            emoji = "🎉"
-            title = "Успешно реализованная сделка"
-        else:
-            emoji = "ℹ️"
-            title = "Информация о сделке"
-
-        message = f"{emoji} <b>{title}</b>\n"
-        message += f"Название: {lead.get('name', 'Без названия')}\n"
-
-        if "price" in lead:
-            message += f"Бюджет: {lead.get('price', '0')} руб.\n"
-
-        if "responsible_user_name" in lead:
-            message += (
-                f"Ответственный: {lead.get('responsible_user_name', 'Не назначен')}\n"
-            )
+        parts = [
+            _LEAD_HEADERS.get(event_type, _LEAD_DEFAULT_HEADER),
+            f"Название: {lead.name}",
+        ]
 
-        status_id = lead.get("status_id")
-        if status_id:
-            status_name = None
-            if "status_name" in lead:
-                status_name = lead["status_name"]
+        if lead.price is not msgspec.UNSET:
+            parts.append(f"Бюджет: {lead.price} руб.")
 
-                DataManager.update_lead_status(scope_id, status_id, status_name)
+        if lead.responsible_user_name is not msgspec.UNSET:
+            parts.append(f"Ответственный: {lead.responsible_user_name}")
 
-            if not status_name:
-                status_name = DataManager.get_status_name(scope_id, status_id)
+        status_id = lead.status_id
+        if status_id:
+            # UNSET, как и пустое значение, ложно
+            status_name = lead.status_name
+            if status_name:
+                DataManager.update_lead_status(scope_id, status_id, status_name)
+            else:
+                status_name = await DataManager.get_status_name(scope_id, status_id)
 
-            message += f"Статус: {status_name}\n"
+            parts.append(f"Статус: {status_name}")
 
-        return message.strip()
+        return "\n".join(parts).strip()
 
     @staticmethod
-    def format_task_message(task: Dict[str, Any], event_type: str) -> str:
+    def format_task_message(task: Task, event_type: str) -> str:
         """Форматирует сообщение о задаче"""
-        if event_type == "new":
-            emoji = "⏰"
-            title = "Создана новая задача"
-        elif event_type == "completed":
-            emoji = "✅"
-            title = "Задача выполнена"
-        else:
-            emoji = "📋"
-            title = "Информация о задаче"
-
-        message = f"{emoji} <b>{title}</b>\n"
-        message += f"Текст: {task.get('text', 'Без описания')}\n"
-
-        if "complete_till" in task:
-
-            complete_till = task.get("complete_till")
+        parts = [
+            _TASK_HEADERS.get(event_type, _TASK_DEFAULT_HEADER),
+            f"Текст: {task.text}",
+        ]
+
+        complete_till = task.complete_till
+        if complete_till is not msgspec.UNSET:
             if isinstance(complete_till, int) and complete_till > 1000000000:
-                complete_till = datetime.fromtimestamp(complete_till).strftime(
-                    "%d.%m.%Y %H:%M"
-                )
-            message += f"Срок: {complete_till}\n"
+                complete_till = format_timestamp(complete_till)
+            parts.append(f"Срок: {complete_till}")
 
-        if "responsible_user_name" in task:
-            message += (
-                f"Ответственный: {task.get('responsible_user_name', 'Не назначен')}\n"
-            )
+        if task.responsible_user_name is not msgspec.UNSET:
+            parts.append(f"Ответственный: {task.responsible_user_name}")
 
-        return message.strip()
+        return "\n".join(parts).strip()
 
     @staticmethod
-    def format_contact_message(contact: Dict[str, Any], event_type: str) -> str:
+    def format_contact_message(contact: Contact, event_type: str) -> str:
         """Форматирует сообщение о контакте"""
-        if event_type == "new":
-            emoji = "👤"
-            title = "Создан новый контакт"
-        else:
-            emoji = "👤"
-            title = "Обновлен контакт"
-
-        message = f"{emoji} <b>{title}</b>\n"
-        name = contact.get("name", "Без имени")
-        message += f"Имя: {name}\n"
-
-        if "custom_fields" in contact:
-            for field in contact.get("custom_fields", []):
-                if field.get("code") == "PHONE":
+        parts = [
+            _CONTACT_HEADERS.get(event_type, _CONTACT_DEFAULT_HEADER),
+            f"Имя: {contact.name}",
+        ]
+
+        custom_fields = contact.custom_fields
+        if custom_fields is not msgspec.UNSET:
+            for field in custom_fields:
+                code = field.get("code")
+                if code == "PHONE":
                     for value in field.get("values", []):
-                        message += f"Телефон: {value.get('value', '')}\n"
+                        parts.append(f"Телефон: {value.get('value', '')}")
                         break
-                if field.get("code") == "EMAIL":
+                if code == "EMAIL":
                     for value in field.get("values", []):
-                        message += f"Email: {value.get('value', '')}\n"
+                        parts.append(f"Email: {value.get('value', '')}")
                         break
 
-        return message.strip()
+        return "\n".join(parts).strip()
+
 
+@app.on_event("startup")
+async def import_statuses():
+    """Переносит статусы из JSON файлов прежнего формата при запуске"""
+    await DataManager.import_legacy_statuses()
 
-@app.post("/webhooks/amocrm/{scope_id}")
-async def amocrm_webhook(scope_id: str, request: Request):
+
+@app.on_event("shutdown")
+async def flush_statuses():
+    """Сохраняет несохранённые статусы при остановке приложения"""
+    await DataManager.flush_all()
+    with _DB_READERS_LOCK:
+        for reader in _DB_READERS:
+            reader.close()
+    with _DB_LOCK:
+        _DB.close()
+
+
+@app.on_event("shutdown")
+async def close_telegram_client():
+    """Закрывает соединения с Telegram API при остановке приложения"""
+    await TELEGRAM_CLIENT.aclose()
+
+
+@app.post("/webhooks/amocrm/{scope_id}", status_code=202)
+async def amocrm_webhook(
+    scope_id: str, request: Request, background_tasks: BackgroundTasks
+):
     """Обработчик webhook от amoCRM"""
     try:
 
-        data = await request.json()
+        # Пустые запросы (проверка доступности) не разбираем
+        if request.headers.get("content-length") == "0":
+            return {"status": "accepted", "message": "Пустой webhook"}
+
+        body = await request.body()
+        if not body.strip():
+            return {"status": "accepted", "message": "Пустой webhook"}
+
+        data = _WEBHOOK_DECODER.decode(body)
         logger.info(f"Получены данные от amoCRM (аккаунт {scope_id}): {data}")
 
+        if (
+            data.leads
+            or data.tasks
+            or data.contacts
+            or data.lead_statuses
+            or data.pipelines
+        ):
+            background_tasks.add_task(_process_all, data, scope_id)
+
+        return {"status": "accepted", "message": "Webhook принят в обработку"}
+
+    except Exception as e:
+        logger.error(f"Ошибка при обработке webhook: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Ошибка обработки: {str(e)}")
+
+
+async def _process_all(data: AmoWebhook, scope_id: str):
+    """Фоновая обработка данных webhook"""
+    try:
+
         chat_id = TELEGRAM_CHAT_IDS.get(scope_id, TELEGRAM_CHAT_IDS["default"])
 
-        if "leads" in data:
-            await process_leads(data["leads"], chat_id, scope_id)
+        jobs = []
+        if data.leads:
+            jobs.append(process_leads(data.leads, chat_id, scope_id))
+
+        if data.tasks:
+            jobs.append(process_tasks(data.tasks, chat_id))
 
-        if "tasks" in data:
-            await process_tasks(data["tasks"], chat_id)
+        if data.contacts:
+            jobs.append(process_contacts(data.contacts, chat_id))
+
+        results = await asyncio.gather(*jobs, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(
+                    f"Ошибка при обработке webhook (аккаунт {scope_id}): {str(result)}"
+                )
 
-        if "contacts" in data:
-            await process_contacts(data["contacts"], chat_id)
+        now_iso = current_iso_time()
 
         # Обработка данных о статусах, если они есть в данных
-        if "lead_statuses" in data:
-            process_lead_statuses(data["lead_statuses"], scope_id)
+        if data.lead_statuses:
+            process_lead_statuses(data.lead_statuses, scope_id, now_iso)
 
         # Обработка данных о воронках, если они есть
-        if "pipelines" in data:
-            process_pipelines(data["pipelines"], scope_id)
-
-        return {"status": "success", "message": "Webhook обработан успешно"}
+        if data.pipelines:
+            process_pipelines(data.pipelines, scope_id, now_iso)
 
     except Exception as e:
-        logger.error(f"Ошибка при обработке webhook: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Ошибка обработки: {str(e)}")
+        logger.error(f"Ошибка при обработке webhook (аккаунт {scope_id}): {str(e)}")
 
 
-async def process_leads(leads: list, chat_id: str, scope_id: str):
-    """Обработка сделок из webhook"""
-    for lead in leads:
+async def send_all(sends: list):
+    """Отправляет сообщения в Telegram параллельно и логирует ошибки"""
+    results = await asyncio.gather(*sends, return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(f"Ошибка отправки сообщения в Telegram: {str(result)}")
 
-        if "add" in lead:
 
-            message = AmoCRMHandler.format_lead_message(lead, "new", scope_id)
-            await TelegramMessage.send_message(chat_id, message)
+def _classify_lead(lead: Lead) -> Optional[str]:
+    """Определяет тип события по данным сделки"""
+    if lead.add is not msgspec.UNSET:
+        return "new"
 
-        elif lead.get("status_id"):
+    status_id = lead.status_id
+    if status_id:
+        if str(status_id) in SUCCESSFUL_STATUS_IDS:
+            return "success"
+        return "update"
 
-            successful_status_ids = [
-                "142",
-                "143",
-            ]  # ID статусов успешно реализованных сделок
-            if str(lead.get("status_id")) in successful_status_ids:
-                message = AmoCRMHandler.format_lead_message(lead, "success", scope_id)
-                await TelegramMessage.send_message(chat_id, message)
-            else:
+    if lead.update is not msgspec.UNSET:
+        return "update"
+
+    return None
 
-                message = AmoCRMHandler.format_lead_message(lead, "update", scope_id)
-                await TelegramMessage.send_message(chat_id, message)
 
-        elif "update" in lead:
+async def _send_lead(lead: Lead, event_type: str, chat_id: str, scope_id: str):
+    """Форматирует и отправляет сообщение об одной сделке"""
+    message = await AmoCRMHandler.format_lead_message(lead, event_type, scope_id)
+    return await TelegramMessage.send_message(chat_id, message)
+
+
+async def process_leads(leads: List[Lead], chat_id: str, scope_id: str):
+    """Обработка сделок из webhook"""
+    sends = []
+    for lead in leads:
+        event_type = _classify_lead(lead)
+        if event_type:
+            sends.append(_send_lead(lead, event_type, chat_id, scope_id))
 
-            message = AmoCRMHandler.format_lead_message(lead, "update", scope_id)
-            await TelegramMessage.send_message(chat_id, message)
+    await send_all(sends)
 
 
-async def process_tasks(tasks: list, chat_id: str):
+async def process_tasks(tasks: List[Task], chat_id: str):
     """Обработка задач из webhook"""
+    sends = []
     for task in tasks:
-        if "add" in task:
+        if task.add is not msgspec.UNSET:
 
             message = AmoCRMHandler.format_task_message(task, "new")
-            await TelegramMessage.send_message(chat_id, message)
+            sends.append(TelegramMessage.send_message(chat_id, message))
 
-        elif task.get("is_completed"):
+        elif task.is_completed:
 
             message = AmoCRMHandler.format_task_message(task, "completed")
-            await TelegramMessage.send_message(chat_id, message)
+            sends.append(TelegramMessage.send_message(chat_id, message))
 
-        elif "update" in task:
+        elif task.update is not msgspec.UNSET:
 
             message = AmoCRMHandler.format_task_message(task, "update")
-            await TelegramMessage.send_message(chat_id, message)
+            sends.append(TelegramMessage.send_message(chat_id, message))
 
+    await send_all(sends)
 
-async def process_contacts(contacts: list, chat_id: str):
+
+async def process_contacts(contacts: List[Contact], chat_id: str):
     """Обработка контактов из webhook"""
+    sends = []
     for contact in contacts:
-        if "add" in contact:
+        if contact.add is not msgspec.UNSET:
 
             message = AmoCRMHandler.format_contact_message(contact, "new")
-            await TelegramMessage.send_message(chat_id, message)
+            sends.append(TelegramMessage.send_message(chat_id, message))
 
-        elif "update" in contact:
+        elif contact.update is not msgspec.UNSET:
 
             message = AmoCRMHandler.format_contact_message(contact, "update")
-            await TelegramMessage.send_message(chat_id, message)
+            sends.append(TelegramMessage.send_message(chat_id, message))
+
+    await send_all(sends)
 
 
-def process_lead_statuses(statuses: list, scope_id: str):
+def process_lead_statuses(
+    statuses: List[Status], scope_id: str, now_iso: Optional[str] = None
+):
     """Обработка информации о статусах сделок"""
+    items = []
     for status in statuses:
-        status_id = status.get("id")
-        status_name = status.get("name")
-        if status_id and status_name:
-            DataManager.update_lead_status(scope_id, status_id, status_name)
+        if status.id and status.name:
+            items.append((status.id, status.name))
 
+    if items:
+        DataManager.bulk_update_lead_statuses(scope_id, items, now_iso)
 
-def process_pipelines(pipelines: list, scope_id: str):
+
+def process_pipelines(
+    pipelines: List[Pipeline], scope_id: str, now_iso: Optional[str] = None
+):
     """Обработка информации о воронках и их статусах"""
+    items = []
     for pipeline in pipelines:
-        if "statuses" in pipeline:
-            for status in pipeline.get("statuses", []):
-                status_id = status.get("id")
-                status_name = status.get("name")
-                if status_id and status_name:
-                    DataManager.update_lead_status(scope_id, status_id, status_name)
+        for status in pipeline.statuses:
+            if status.id and status.name:
+                items.append((status.id, status.name))
+
+    if items:
+        DataManager.bulk_update_lead_statuses(scope_id, items, now_iso)
 
 
 @app.get("/status/{scope_id}")
 async def get_statuses(scope_id: str):
     """Эндпоинт для просмотра сохраненных статусов"""
-    statuses = DataManager.load_lead_statuses(scope_id)
+    statuses = await DataManager.get_lead_statuses(scope_id)
     return {"scope_id": scope_id, "statuses": statuses}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        "app:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)),
+        access_log=False,
+    )